@@ -1,79 +1,222 @@
 import sys
+import ctypes
 import cv2
 import numpy as np
 import os
+import queue
+import threading
+import warnings
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, 
                            QPushButton, QVBoxLayout, QHBoxLayout, QMessageBox)
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QImage, QPixmap
 import time
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, fall back to plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+try:
+    import dlib
+except ImportError:  # dlib is optional, fall back to the eye cascade
+    dlib = None
+
+try:
+    import dbus
+except ImportError:  # dbus-python is optional, fall back to systemctl
+    dbus = None
+
+# Load the pre-trained Haar cascade classifiers once at import
+FACE_CASCADE = cv2.CascadeClassifier(
+    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+)
+EYE_CASCADE = cv2.CascadeClassifier(
+    cv2.data.haarcascades + 'haarcascade_eye.xml'
+)
+
+@njit(cache=True, fastmath=True)
+def any_eye_open(eyes, threshold):
+    """Check if any eye in an (N, 4) int32 array of (x, y, w, h) boxes is open"""
+    # Simplified EAR using the height/width ratio of the eye box, compared as
+    # height > threshold * width so no division is needed
+    return bool((eyes[:, 3] > threshold * eyes[:, 2]).any())
+
+def calculate_landmark_ear(eyes):
+    """Calculate the true eye aspect ratio for an (..., 6, 2) array of eye landmarks"""
+    # EAR = (||p2-p6|| + ||p3-p5||) / (2 * ||p1-p4||)
+    vertical = (np.linalg.norm(eyes[..., 1, :] - eyes[..., 5, :], axis=-1) +
+                np.linalg.norm(eyes[..., 2, :] - eyes[..., 4, :], axis=-1))
+    horizontal = np.linalg.norm(eyes[..., 0, :] - eyes[..., 3, :], axis=-1)
+    return vertical / np.maximum(2 * horizontal, 1)
+
 class DrowsinessDetector:
-    def __init__(self):
-        # Load the pre-trained Haar cascade classifiers
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-        self.eye_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_eye.xml'
-        )
+    def __init__(self, face_model_path='face_detection_yunet_2022mar.onnx',
+                 landmark_model_path='shape_predictor_68_face_landmarks.dat'):
+        # Leave one core free for the capture and GUI threads; this is process-wide,
+        # so it is set once rather than switched per pass while other threads run
+        self.num_threads = max(1, (os.cpu_count() or 1) - 1)
+        cv2.setNumThreads(self.num_threads)
+        
+        # Run the face cascade through OpenCV's transparent API when OpenCL is available
+        self.use_opencl = cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
+        
+        # Prefer the YuNet DNN face detector when its model file is available
+        self.face_net = None
+        if os.path.exists(face_model_path):
+            backend, target = self.select_dnn_target()
+            self.face_net = cv2.FaceDetectorYN.create(
+                face_model_path, '', (320, 320), 0.6, 0.3, 5000, backend, target
+            )
+        
+        # Prefer dlib's 68-point landmarks over the eye cascade when available
+        self.predictor = None
+        if dlib is not None and os.path.exists(landmark_model_path):
+            self.predictor = dlib.shape_predictor(landmark_model_path)
         
         # Constants for drowsiness detection
         self.EYE_ASPECT_RATIO_THRESHOLD = 0.25
-        self.EYE_ASPECT_RATIO_CONSEC_FRAMES = 30  # ~2 seconds at 15 FPS
+        self.EYES_CLOSED_SECONDS = 2.0  # Drowsy once eyes stay closed this long
+        self.DETECTION_WIDTH = 320  # Face detection runs on a frame this wide
+        self.FACE_DETECTION_INTERVAL = 5  # Re-detect faces every Nth frame
+        self.FACE_MIN_SIZE = 80  # Expected webcam face size range in full-frame pixels
+        self.FACE_MAX_SIZE = 400
+        
+        # Time the eyes were first seen closed, None while they are open
+        self.eyes_closed_since = None
         
-        # Initialize counters
-        self.frame_counter = 0
-        self.last_eye_check_time = time.time()
+        # Faces found by the last full detection, reused in between
+        self.last_faces = []
+        self.frames_since_detection = 0
+        
+        # Grayscale buffer reused across frames, allocated on the first frame
+        self.gray_buffer = None
+
+    def reset(self):
+        """Forget faces and eye state from a previous detection session"""
+        self.last_faces = []
+        self.frames_since_detection = 0
+        self.eyes_closed_since = None
 
-    def calculate_ear(self, eye_points):
-        """Calculate the eye aspect ratio"""
-        # Simplified EAR calculation using the height/width ratio of eye region
-        height = eye_points[3] - eye_points[1]
-        width = eye_points[2] - eye_points[0]
-        ear = height / width if width != 0 else 0
-        return ear
+    def select_dnn_target(self):
+        """Pick the fastest available DNN backend: CUDA, then OpenCL, then CPU"""
+        if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+            return cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA_FP16
+        if cv2.ocl.haveOpenCL():
+            return cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_OPENCL
+        return cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
 
-    def detect_drowsiness(self, frame):
+    def detect_faces(self, frame, gray):
+        """
+        Detect faces on a downscaled copy of the frame
+        Returns: list of (x, y, w, h) in full-resolution coordinates
+        """
+        scale = min(1.0, self.DETECTION_WIDTH / gray.shape[1])
+        
+        if self.face_net is not None:
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self.face_net.setInputSize((small.shape[1], small.shape[0]))
+            _, detections = self.face_net.detect(small)
+            faces = [] if detections is None else detections[:, :4]
+        else:
+            src = cv2.UMat(gray) if self.use_opencl else gray
+            small = cv2.resize(src, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            min_size = int(self.FACE_MIN_SIZE * scale)
+            max_size = int(self.FACE_MAX_SIZE * scale)
+            faces = FACE_CASCADE.detectMultiScale(
+                small, scaleFactor=1.2, minNeighbors=5,
+                minSize=(min_size, min_size), maxSize=(max_size, max_size),
+                flags=cv2.CASCADE_SCALE_IMAGE
+            )
+        
+        # DNN boxes may extend past the frame edges, so clip their corners to it
+        frame_h, frame_w = gray.shape[:2]
+        clipped = []
+        for (x, y, w, h) in faces:
+            x1, y1 = max(0, int(x / scale)), max(0, int(y / scale))
+            x2, y2 = min(frame_w, int((x + w) / scale)), min(frame_h, int((y + h) / scale))
+            if x2 > x1 and y2 > y1:
+                clipped.append((x1, y1, x2 - x1, y2 - y1))
+        return clipped
+
+    def check_eyes_cascade(self, frame, gray, x, y, w, h):
+        """
+        Check the eyes in a face region with the eye cascade
+        Returns: True if open, False if closed, None if not found
+        """
+        roi_gray = gray[y:y+h, x:x+w]
+        roi_color = frame[y:y+h, x:x+w]
+        
+        # Detect eyes in the face region
+        eyes = EYE_CASCADE.detectMultiScale(roi_gray, minSize=(w // 8, h // 8))
+        if len(eyes) < 2:  # We need at least two eyes for detection
+            return None
+        
+        for (ex, ey, ew, eh) in eyes:
+            cv2.rectangle(roi_color, (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
+        
+        return any_eye_open(np.asarray(eyes, dtype=np.int32), self.EYE_ASPECT_RATIO_THRESHOLD)
+
+    def check_eyes_landmarks(self, frame, gray, x, y, w, h):
+        """
+        Check the eyes in a face region with dlib facial landmarks
+        Returns: True if open, False if closed
+        """
+        shape = self.predictor(gray, dlib.rectangle(x, y, x + w, y + h))
+        
+        # Points 36-41 and 42-47 outline the two eyes
+        eyes = np.array([(shape.part(i).x, shape.part(i).y) for i in range(36, 48)],
+                        dtype=np.int32).reshape(2, 6, 2)
+        cv2.polylines(frame, list(eyes), True, (0, 255, 0), 1)
+        
+        ears = calculate_landmark_ear(eyes.astype(np.float32))
+        return ears.mean() > self.EYE_ASPECT_RATIO_THRESHOLD
+
+    def detect_drowsiness(self, frame, gray=None):
         """
         Detect drowsiness in the given frame
+        If gray is None it is derived from the BGR frame
         Returns: (processed_frame, is_drowsy)
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        if gray is None:
+            if self.gray_buffer is None or self.gray_buffer.shape != frame.shape[:2]:
+                self.gray_buffer = np.empty(frame.shape[:2], np.uint8)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray_buffer)
+        
+        # Faces barely move between frames, so only search for them every Nth frame
+        if self.frames_since_detection % self.FACE_DETECTION_INTERVAL == 0:
+            self.last_faces = self.detect_faces(frame, gray)
+        self.frames_since_detection += 1
+        faces = self.last_faces
         
         is_drowsy = False
         
+        if self.predictor is not None:
+            check_eyes = self.check_eyes_landmarks
+        else:
+            check_eyes = self.check_eyes_cascade
+        
         for (x, y, w, h) in faces:
             cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
-            roi_gray = gray[y:y+h, x:x+w]
-            roi_color = frame[y:y+h, x:x+w]
+            eyes_open = check_eyes(frame, gray, x, y, w, h)
             
-            # Detect eyes in the face region
-            eyes = self.eye_cascade.detectMultiScale(roi_gray)
+            if eyes_open is None:  # Reset timer if we can't detect eyes
+                self.eyes_closed_since = None
+                continue
             
-            if len(eyes) >= 2:  # We need at least two eyes for detection
-                eyes_open = False
-                for (ex, ey, ew, eh) in eyes:
-                    cv2.rectangle(roi_color, (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
-                    eye_points = [ex, ey, ex+ew, ey+eh]
-                    ear = self.calculate_ear(eye_points)
-                    
-                    if ear > self.EYE_ASPECT_RATIO_THRESHOLD:
-                        eyes_open = True
-                        break
-                
-                if not eyes_open:
-                    self.frame_counter += 1
-                else:
-                    self.frame_counter = 0
-                
-                # Check if eyes have been closed for too long
-                if self.frame_counter >= self.EYE_ASPECT_RATIO_CONSEC_FRAMES:
-                    is_drowsy = True
+            if not eyes_open:
+                if self.eyes_closed_since is None:
+                    self.eyes_closed_since = time.monotonic()
+            else:
+                self.eyes_closed_since = None
             
-            else:  # Reset counter if we can't detect eyes
-                self.frame_counter = 0
+            # Check if eyes have been closed for too long; this is time based because
+            # the pipeline processes frames as fast as the camera delivers them
+            if (self.eyes_closed_since is not None and
+                    time.monotonic() - self.eyes_closed_since >= self.EYES_CLOSED_SECONDS):
+                is_drowsy = True
         
         return frame, is_drowsy
 
@@ -82,6 +225,10 @@ class DrowsinessDetectorGUI(QMainWindow):
         super().__init__()
         self.initUI()
         
+        # Display buffer and the QImage wrapping it, reallocated when the size changes
+        self.display_buffer = None
+        self.qt_image = None
+        
         # Initialize video capture and drowsiness detector
         self.cap = None
         self.detector = DrowsinessDetector()
@@ -90,6 +237,28 @@ class DrowsinessDetectorGUI(QMainWindow):
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         
+        # Single-slot latest frame between the capture and detection stages
+        self.latest_frame = None
+        self.frame_lock = threading.Lock()
+        self.frame_ready = threading.Event()
+        
+        # Bounded queue between the detection and display stages
+        self.result_queue = queue.Queue(maxsize=2)
+        self.workers = []
+        self.stop_event = threading.Event()  # Replaced for each detection session
+        
+        # Whether the webcam delivers raw YUYV frames instead of BGR
+        self.raw_yuyv = False
+        self.frame_width = 0
+        self.frame_height = 0
+        
+        # Set by the capture thread when the webcam stops delivering frames
+        self.capture_failed = False
+        self.MAX_CAPTURE_FAILURES = 40  # ~2 seconds of consecutive failed reads
+        
+        # Set by the detection thread if detection raised, so the GUI can report it
+        self.detection_error = None
+        
         # Drowsiness detection state
         self.is_running = False
         self.warning_shown = False
@@ -138,8 +307,20 @@ class DrowsinessDetectorGUI(QMainWindow):
             if not self.cap.isOpened():
                 QMessageBox.critical(self, 'Error', 'Could not access webcam!')
                 return
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Keep only the newest frame in the driver
+            self.request_yuyv()
         
+        self.detector.reset()
         self.is_running = True
+        self.capture_failed = False
+        self.detection_error = None
+        self.stop_event = threading.Event()
+        self.workers = [
+            threading.Thread(target=self.capture_loop, args=(self.cap, self.stop_event), daemon=True),
+            threading.Thread(target=self.detection_loop, args=(self.stop_event,), daemon=True),
+        ]
+        for worker in self.workers:
+            worker.start()
         self.timer.start(50)  # Update every 50ms (~20 FPS)
         self.start_button.setEnabled(False)
         self.stop_button.setEnabled(True)
@@ -148,10 +329,21 @@ class DrowsinessDetectorGUI(QMainWindow):
     def stop_detection(self):
         """Stop the drowsiness detection"""
         self.is_running = False
+        self.stop_event.set()
         self.timer.stop()
-        if self.cap is not None:
+        
+        # Don't freeze the GUI on a hung camera; a worker that is still blocked in
+        # grab() exits on its own, and the capture thread releases its camera then
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+        if self.cap is not None and not self.workers:
             self.cap.release()
-            self.cap = None
+        self.cap = None
+        self.workers = []
+        self.latest_frame = None
+        self.frame_ready.clear()
+        while not self.result_queue.empty():
+            self.result_queue.get_nowait()
         
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
@@ -159,20 +351,125 @@ class DrowsinessDetectorGUI(QMainWindow):
         self.video_label.clear()
         self.warning_shown = False
 
+    def request_yuyv(self):
+        """Ask the webcam for raw YUYV frames so grayscale comes straight from the Y plane"""
+        self.raw_yuyv = False
+        for code in ('YUY2', 'YUYV'):
+            fourcc = cv2.VideoWriter_fourcc(*code)
+            if self.cap.set(cv2.CAP_PROP_FOURCC, fourcc) and int(self.cap.get(cv2.CAP_PROP_FOURCC)) == fourcc:
+                self.raw_yuyv = self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+                break
+        self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def decode_frame(self, cap, raw):
+        """
+        Split a captured frame into display and detection images
+        Returns: (bgr_frame or None if the frame was dropped, gray_frame or None)
+        """
+        if not self.raw_yuyv:
+            return raw, None
+        
+        if raw.dtype == np.uint8 and raw.ndim == 3 and raw.shape[2] == 2:
+            pass  # Already (H, W, 2) YUYV
+        elif (raw.dtype == np.uint8 and self.frame_width * self.frame_height > 0 and
+                raw.size == self.frame_height * self.frame_width * 2):
+            # Some backends return the raw buffer flattened to a single row
+            raw = raw.reshape(self.frame_height, self.frame_width, 2)
+        elif raw.ndim == 3 and raw.shape[2] == 3:
+            # The backend accepted the request but still delivers BGR
+            self.raw_yuyv = False
+            return raw, None
+        else:
+            # Unknown raw layout (e.g. MJPEG), so back out to OpenCV's own conversion
+            self.raw_yuyv = False
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return None, None
+        
+        frame = cv2.cvtColor(raw, cv2.COLOR_YUV2BGR_YUY2)
+        gray = cv2.cvtColor(raw, cv2.COLOR_YUV2GRAY_YUY2)
+        return frame, gray
+
+    def capture_loop(self, cap, stop_event):
+        """Read frames from the webcam and feed the detection stage"""
+        try:
+            failures = 0
+            while not stop_event.is_set():
+                ret = cap.grab()
+                if ret:
+                    ret, raw = cap.retrieve()
+                if stop_event.is_set():
+                    break
+                if not ret:
+                    # Back off instead of spinning, and give up if the webcam is gone
+                    failures += 1
+                    if failures >= self.MAX_CAPTURE_FAILURES:
+                        self.capture_failed = True
+                        return
+                    time.sleep(0.05)
+                    continue
+                failures = 0
+                frame, gray = self.decode_frame(cap, raw)
+                if frame is None:
+                    continue
+                
+                # Overwrite any frame the detection stage has not picked up yet
+                with self.frame_lock:
+                    self.latest_frame = (frame, gray)
+                    self.frame_ready.set()
+        finally:
+            # Only this thread may release the camera, so it is never freed mid-grab()
+            cap.release()
+
+    def detection_loop(self, stop_event):
+        """Run drowsiness detection on captured frames"""
+        while not stop_event.is_set():
+            if not self.frame_ready.wait(timeout=0.1):
+                continue
+            with self.frame_lock:
+                frame, gray = self.latest_frame
+                self.latest_frame = None
+                self.frame_ready.clear()
+            
+            try:
+                result = self.detector.detect_drowsiness(frame, gray)
+            except Exception as e:
+                self.detection_error = e
+                return
+            self.put_latest(self.result_queue, result)
+
+    def put_latest(self, q, item):
+        """Put item on a bounded queue, dropping the oldest entry if it is full"""
+        while self.is_running:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+
     def update_frame(self):
-        """Update the video frame and check for drowsiness"""
-        if not self.is_running or self.cap is None:
+        """Display the latest processed frame and check for drowsiness"""
+        if not self.is_running:
             return
         
-        ret, frame = self.cap.read()
-        if not ret:
+        if self.capture_failed:
+            self.stop_detection()
+            QMessageBox.critical(self, 'Error', 'Lost connection to webcam!')
             return
         
-        # Flip frame horizontally for mirror effect
-        frame = cv2.flip(frame, 1)
+        if self.detection_error is not None:
+            error = self.detection_error
+            self.stop_detection()
+            QMessageBox.critical(self, 'Error', f'Drowsiness detection failed: {error}')
+            return
         
-        # Detect drowsiness
-        frame, is_drowsy = self.detector.detect_drowsiness(frame)
+        try:
+            frame, is_drowsy = self.result_queue.get_nowait()
+        except queue.Empty:
+            return
         
         # Update status and show warning if drowsy
         if is_drowsy:
@@ -184,15 +481,24 @@ class DrowsinessDetectorGUI(QMainWindow):
             self.status_label.setText('Status: Awake')
             self.warning_shown = False
         
+        # Resize to fit the video area, keeping the aspect ratio
+        h, w, ch = frame.shape
+        label_size = self.video_label.size()
+        scale = min(label_size.width() / w, label_size.height() / h)
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        if self.display_buffer is None or self.display_buffer.shape[:2] != (size[1], size[0]):
+            self.display_buffer = np.empty((size[1], size[0], ch), np.uint8)
+            # Qt reads the BGR buffer directly (Format_BGR888, Qt 5.14+), no conversion needed
+            self.qt_image = QImage(self.display_buffer.data, size[0], size[1],
+                                   self.display_buffer.strides[0], QImage.Format_BGR888)
+        cv2.resize(frame, size, dst=self.display_buffer, interpolation=cv2.INTER_LINEAR)
+        
+        # Flip horizontally for mirror effect; detection is mirror-invariant so only
+        # the small display image needs it, and the drawn boxes flip along with it
+        cv2.flip(self.display_buffer, 1, dst=self.display_buffer)
+        
         # Convert frame to QPixmap and display
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_frame.shape
-        bytes_per_line = ch * w
-        qt_image = QImage(rgb_frame.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        scaled_pixmap = QPixmap.fromImage(qt_image).scaled(
-            self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
-        )
-        self.video_label.setPixmap(scaled_pixmap)
+        self.video_label.setPixmap(QPixmap.fromImage(self.qt_image))
 
     def show_warning(self):
         """Show warning message and initiate system shutdown/sleep"""
@@ -210,17 +516,45 @@ class DrowsinessDetectorGUI(QMainWindow):
     def initiate_sleep(self):
         """Initiate system sleep/shutdown"""
         if sys.platform == "win32":
-            os.system("shutdown /h")  # Hibernate on Windows
-        else:
+            # Hibernate on Windows; SetSuspendState returns 0 on failure
+            if not ctypes.windll.powrprof.SetSuspendState(True, False, False):
+                os.system("shutdown /h")
+        elif not self.suspend_via_logind():
             os.system("systemctl suspend")  # Sleep on Linux
         self.stop_detection()
 
+    def suspend_via_logind(self):
+        """Ask systemd-logind to suspend over D-Bus, returns False if unavailable"""
+        if dbus is None:
+            return False
+        try:
+            login1 = dbus.SystemBus().get_object('org.freedesktop.login1', '/org/freedesktop/login1')
+            login1.Suspend(True, dbus_interface='org.freedesktop.login1.Manager')
+        except dbus.DBusException:
+            return False
+        return True
+
     def closeEvent(self, event):
         """Handle application closure"""
         self.stop_detection()
         event.accept()
 
+def check_opencv_build():
+    """Warn if OpenCV was built without the SIMD and threading features we rely on"""
+    info = {}
+    for line in cv2.getBuildInformation().splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            info.setdefault(key.strip(), value.strip())
+    
+    cpu_features = info.get('Baseline', '') + ' ' + info.get('Dispatched code generation', '')
+    if 'AVX2' not in cpu_features.split():
+        warnings.warn('OpenCV was built without AVX2 support; detection will be slower')
+    if 'TBB' not in info.get('Parallel framework', ''):
+        warnings.warn('OpenCV was built without TBB; see README for building it from source')
+
 def main():
+    check_opencv_build()
     app = QApplication(sys.argv)
     window = DrowsinessDetectorGUI()
     window.show()